@@ -1,4 +1,5 @@
 from datetime import datetime
+from itertools import chain
 
 from onyx.agents.agent_search.deep_search.initial.generate_individual_sub_answer.states import (
     AnswerQuestionOutput,
@@ -7,7 +8,7 @@ from onyx.agents.agent_search.deep_search.main.states import (
     SubQuestionResultsUpdate,
 )
 from onyx.agents.agent_search.shared_graph_utils.operators import (
-    dedup_inference_sections,
+    dedup_inference_sections_by_chunk,
 )
 from onyx.agents.agent_search.shared_graph_utils.utils import (
     get_langgraph_node_log_string,
@@ -23,21 +24,27 @@ def format_initial_sub_answers(
     """
     node_start_time = datetime.now()
 
-    documents = []
-    context_documents = []
-    cited_documents = []
     answer_results = state.answer_results
-    for answer_result in answer_results:
-        documents.extend(answer_result.verified_reranked_documents)
-        context_documents.extend(answer_result.context_documents)
-        cited_documents.extend(answer_result.cited_documents)
 
     return SubQuestionResultsUpdate(
-        # Deduping is done by the documents operator for the main graph
-        # so we might not need to dedup here
-        verified_reranked_documents=dedup_inference_sections(documents, []),
-        context_documents=dedup_inference_sections(context_documents, []),
-        cited_documents=dedup_inference_sections(cited_documents, []),
+        # Merging sections per document is done by the documents operator
+        # for the main graph, so only drop duplicate sections here
+        verified_reranked_documents=dedup_inference_sections_by_chunk(
+            chain.from_iterable(
+                answer_result.verified_reranked_documents
+                for answer_result in answer_results
+            )
+        ),
+        context_documents=dedup_inference_sections_by_chunk(
+            chain.from_iterable(
+                answer_result.context_documents for answer_result in answer_results
+            )
+        ),
+        cited_documents=dedup_inference_sections_by_chunk(
+            chain.from_iterable(
+                answer_result.cited_documents for answer_result in answer_results
+            )
+        ),
         sub_question_results=answer_results,
         log_messages=[
             get_langgraph_node_log_string(
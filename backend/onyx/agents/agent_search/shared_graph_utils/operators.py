@@ -1,3 +1,5 @@
+from collections.abc import Iterable
+
 from onyx.agents.agent_search.shared_graph_utils.models import (
     SubQuestionAnswerResults,
 )
@@ -5,9 +7,47 @@ from onyx.chat.prune_and_merge import _merge_sections
 from onyx.context.search.models import InferenceSection
 
 
+def _has_new_chunks(
+    existing_sections: list[InferenceSection],
+    new_sections: list[InferenceSection],
+) -> bool:
+    """
+    Whether merging new_sections into existing_sections would add a chunk or
+    improve the score of a chunk that is already there.
+    """
+    existing_chunk_scores: dict[tuple[str, int], float | None] = {
+        (section.center_chunk.document_id, chunk.chunk_id): chunk.score
+        for section in existing_sections
+        for chunk in [section.center_chunk] + section.chunks
+    }
+
+    for section in new_sections:
+        for chunk in [section.center_chunk] + section.chunks:
+            key = (section.center_chunk.document_id, chunk.chunk_id)
+            if key not in existing_chunk_scores:
+                return True
+
+            existing_score = existing_chunk_scores[key]
+            if chunk.score is not None and (
+                existing_score is None or chunk.score > existing_score
+            ):
+                return True
+
+    return False
+
+
 def dedup_inference_sections(
     list1: list[InferenceSection], list2: list[InferenceSection]
 ) -> list[InferenceSection]:
+    """
+    Only valid as a graph state reducer, where list1 is the current state and
+    therefore already the output of _merge_sections. The same documents tend to
+    come back across sub-questions and refinement rounds, so re-merging (and
+    rebuilding combined_content) is skipped when list2 adds nothing to list1.
+    """
+    if list1 and list2 and not _has_new_chunks(list1, list2):
+        return list1
+
     deduped = _merge_sections(list1 + list2)
     return deduped
 
@@ -19,6 +59,30 @@ def dedup_inference_section_list(
     return deduped
 
 
+def dedup_inference_sections_by_chunk(
+    sections: Iterable[InferenceSection],
+) -> list[InferenceSection]:
+    """
+    Single pass removal of exact duplicate sections, i.e. sections of the same
+    document with the same chunks and chunk scores. Sections that differ in any
+    chunk are all kept, merging them per document is left to the state reducers.
+    """
+    deduped: dict[
+        tuple[str, frozenset[tuple[int, float | None]]], InferenceSection
+    ] = {}
+    for section in sections:
+        key = (
+            section.center_chunk.document_id,
+            frozenset(
+                (chunk.chunk_id, chunk.score)
+                for chunk in [section.center_chunk] + section.chunks
+            ),
+        )
+        deduped.setdefault(key, section)
+
+    return list(deduped.values())
+
+
 def dedup_question_answer_results(
     question_answer_results_1: list[SubQuestionAnswerResults],
     question_answer_results_2: list[SubQuestionAnswerResults],
@@ -1,4 +1,5 @@
 import json
+import logging
 from collections import defaultdict
 from copy import deepcopy
 from typing import TypeVar
@@ -374,6 +375,11 @@ def _merge_sections(sections: list[InferenceSection]) -> list[InferenceSection]:
         reverse=True,
     )
 
+    # the merge statistics take extra passes over the sections,
+    # so only compute them when they will actually be logged
+    if not logger.isEnabledFor(logging.DEBUG):
+        return new_sections
+
     try:
         num_original_sections = len(sections)
         num_original_document_ids = len(
@@ -1,31 +1,38 @@
 import json
-import time
+from collections import deque
 from collections.abc import Callable
 from collections.abc import Iterator
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from functools import wraps
+from itertools import chain
 from typing import Any
 from typing import cast
 from typing import TypeVar
 from urllib.parse import quote
+from urllib.parse import urlencode
 
 import bs4
+import orjson
 from atlassian import Confluence  # type:ignore
 from pydantic import BaseModel
 from redis import Redis
 from requests import HTTPError
+from requests.adapters import HTTPAdapter
 
 from ee.onyx.configs.app_configs import OAUTH_CONFLUENCE_CLOUD_CLIENT_ID
 from ee.onyx.configs.app_configs import OAUTH_CONFLUENCE_CLOUD_CLIENT_SECRET
-from onyx.connectors.confluence.utils import _handle_http_error
+from onyx.connectors.confluence.utils import _call_with_rate_limit_retries
 from onyx.connectors.confluence.utils import confluence_refresh_tokens
 from onyx.connectors.confluence.utils import get_start_param_from_url
+from onyx.connectors.confluence.utils import RateLimitWindow
 from onyx.connectors.confluence.utils import update_param_in_path
 from onyx.connectors.interfaces import CredentialsProviderInterface
 from onyx.file_processing.html_utils import format_document_soup
 from onyx.redis.redis_pool import get_redis_client
 from onyx.utils.logger import setup_logger
+from onyx.utils.threadpool_concurrency import run_functions_tuples_in_parallel
 
 logger = setup_logger()
 
@@ -37,6 +44,16 @@ F = TypeVar("F", bound=Callable[..., Any])
 _PROBLEMATIC_EXPANSIONS = "body.storage.value"
 _REPLACEMENT_EXPANSIONS = "body.view.value"
 
+# public methods of the underlying client that don't make requests,
+# so there is nothing to retry and no need to wrap them
+_NON_HTTP_CONFLUENCE_METHODS = {
+    "close",
+    "log_curl_debug",
+    "raise_for_status",
+    "resource_url",
+    "url_joiner",
+}
+
 _USER_NOT_FOUND = "Unknown Confluence User"
 _USER_ID_TO_DISPLAY_NAME_CACHE: dict[str, str | None] = {}
 _USER_EMAIL_CACHE: dict[str, str | None] = {}
@@ -58,6 +75,8 @@ class ConfluenceUser(BaseModel):
 
 _DEFAULT_PAGINATION_LIMIT = 1000
 _MINIMUM_PAGINATION_LIMIT = 50
+_MAX_EXPANSION_PAGINATION_WORKERS = 8
+_CONNECTION_POOL_SIZE = 32
 
 
 class OnyxConfluence:
@@ -100,6 +119,13 @@ class OnyxConfluence:
 
         self._kwargs: Any = None
 
+        # set once a cloud tenant is known to be affected by CONFCLOUD-76433,
+        # so later queries don't waste a call on the problematic expansion
+        self._use_replacement_expansions = False
+
+        # shared by all threads using this client, e.g. the expansion workers
+        self._rate_limit_window = RateLimitWindow()
+
         self.shared_base_kwargs = {
             "api_version": "cloud" if is_cloud else "latest",
             "backoff_and_retry": True,
@@ -290,73 +316,55 @@ class OnyxConfluence:
                     **kwargs,
                 )
 
+        OnyxConfluence._configure_connection_pool(confluence)
         return confluence
 
+    @staticmethod
+    def _configure_connection_pool(confluence: Confluence) -> None:
+        """Resize the connection pools of the client's requests session so that
+        concurrent calls (e.g. expansion pagination) can all reuse keep-alive
+        connections. The retry settings of each adapter are carried over."""
+        session = confluence._session
+        for prefix, adapter in list(session.adapters.items()):
+            session.mount(
+                prefix,
+                HTTPAdapter(
+                    pool_connections=_CONNECTION_POOL_SIZE,
+                    pool_maxsize=_CONNECTION_POOL_SIZE,
+                    max_retries=adapter.max_retries,
+                ),
+            )
+
     # https://developer.atlassian.com/cloud/confluence/rate-limiting/
     # this uses the native rate limiting option provided by the
     # confluence client and otherwise applies a simpler set of error handling
     def _make_rate_limited_confluence_method(
         self, name: str, credential_provider: CredentialsProviderInterface | None
     ) -> Callable[..., Any]:
-        def wrapped_call(*args: list[Any], **kwargs: Any) -> Any:
-            MAX_RETRIES = 5
+        def call_confluence(*args: list[Any], **kwargs: Any) -> Any:
+            if credential_provider:
+                # only hold the credential lock while renewing, so that
+                # concurrent calls don't serialize on it
+                with credential_provider:
+                    credentials, renewed = self._renew_credentials()
+                    if renewed:
+                        self._confluence = self._initialize_connection_helper(
+                            credentials, **self._kwargs
+                        )
+
+            attr = getattr(self._confluence, name, None)
+            if attr is None:
+                # The underlying Confluence client doesn't have this attribute
+                raise AttributeError(
+                    f"'{type(self).__name__}' object has no attribute '{name}'"
+                )
 
-            TIMEOUT = 600
-            timeout_at = time.monotonic() + TIMEOUT
+            return attr(*args, **kwargs)
 
-            for attempt in range(MAX_RETRIES):
-                if time.monotonic() > timeout_at:
-                    raise TimeoutError(
-                        f"Confluence call attempts took longer than {TIMEOUT} seconds."
-                    )
-
-                # we're relying more on the client to rate limit itself
-                # and applying our own retries in a more specific set of circumstances
-                try:
-                    if credential_provider:
-                        with credential_provider:
-                            credentials, renewed = self._renew_credentials()
-                            if renewed:
-                                self._confluence = self._initialize_connection_helper(
-                                    credentials, **self._kwargs
-                                )
-                            attr = getattr(self._confluence, name, None)
-                            if attr is None:
-                                # The underlying Confluence client doesn't have this attribute
-                                raise AttributeError(
-                                    f"'{type(self).__name__}' object has no attribute '{name}'"
-                                )
-
-                            return attr(*args, **kwargs)
-                    else:
-                        attr = getattr(self._confluence, name, None)
-                        if attr is None:
-                            # The underlying Confluence client doesn't have this attribute
-                            raise AttributeError(
-                                f"'{type(self).__name__}' object has no attribute '{name}'"
-                            )
-
-                        return attr(*args, **kwargs)
-
-                except HTTPError as e:
-                    delay_until = _handle_http_error(e, attempt)
-                    logger.warning(
-                        f"HTTPError in confluence call. "
-                        f"Retrying in {delay_until} seconds..."
-                    )
-                    while time.monotonic() < delay_until:
-                        # in the future, check a signal here to exit
-                        time.sleep(1)
-                except AttributeError as e:
-                    # Some error within the Confluence library, unclear why it fails.
-                    # Users reported it to be intermittent, so just retry
-                    if attempt == MAX_RETRIES - 1:
-                        raise e
-
-                    logger.exception(
-                        "Confluence Client raised an AttributeError. Retrying..."
-                    )
-                    time.sleep(5)
+        def wrapped_call(*args: list[Any], **kwargs: Any) -> Any:
+            return _call_with_rate_limit_retries(
+                lambda: call_confluence(*args, **kwargs), self._rate_limit_window
+            )
 
         return wrapped_call
 
@@ -392,8 +400,8 @@ class OnyxConfluence:
         if not callable(attr):
             return attr
 
-        # skip methods that start with "_"
-        if name.startswith("_"):
+        # skip methods that start with "_" and helpers that never hit the network
+        if name.startswith("_") or name in _NON_HTTP_CONFLUENCE_METHODS:
             return attr
 
         # wrap the method with our retry handler
@@ -401,9 +409,17 @@ class OnyxConfluence:
             ..., Any
         ] = self._make_rate_limited_confluence_method(name, self._credentials_provider)
 
+        # copy the metadata from the class's function rather than the bound
+        # method, so __wrapped__ doesn't keep this client alive after it's
+        # replaced on credential renewal
+        @wraps(getattr(type(self._confluence), name, attr))
         def wrapped_method(*args: Any, **kwargs: Any) -> Any:
             return rate_limited_method(*args, **kwargs)
 
+        # cache the wrapper on the instance so later lookups skip __getattr__.
+        # the wrapper resolves the method on self._confluence at call time,
+        # so it stays valid when the client is re-initialized.
+        self.__dict__[name] = wrapped_method
         return wrapped_method
 
     def _paginate_url(
@@ -412,14 +428,34 @@ class OnyxConfluence:
         """
         This will paginate through the top level query.
         """
+        yield from chain.from_iterable(
+            self._paginate_url_batched(url_suffix, limit, auto_paginate)
+        )
+
+    def _paginate_url_batched(
+        self, url_suffix: str, limit: int | None = None, auto_paginate: bool = False
+    ) -> Iterator[list[dict[str, Any]]]:
+        """
+        This will paginate through the top level query, yielding the results
+        of each page as a list.
+        """
         if not limit:
             limit = _DEFAULT_PAGINATION_LIMIT
 
         connection_char = "&" if "?" in url_suffix else "?"
         url_suffix += f"{connection_char}limit={limit}"
 
+        if self._use_replacement_expansions:
+            url_suffix = url_suffix.replace(
+                _PROBLEMATIC_EXPANSIONS, _REPLACEMENT_EXPANSIONS
+            )
+
+        # set when the expansion was replaced after a failure that looks like
+        # CONFCLOUD-76433, as opposed to a transient error (429, 502, 503...).
+        # only remembered if the very next request succeeds
+        replaced_problematic_expansions = False
         while url_suffix:
-            logger.debug(f"Making confluence call to {url_suffix}")
+            logger.debug("Making confluence call to %s", url_suffix)
             try:
                 raw_response = self.get(
                     path=url_suffix,
@@ -434,6 +470,10 @@ class OnyxConfluence:
             except Exception as e:
                 logger.warning(f"Error in confluence call to {url_suffix}")
 
+                # if we just replaced the expansion, the replacement didn't
+                # fix this (e.g. the limit is too large), so don't remember it
+                replaced_problematic_expansions = False
+
                 # If the problematic expansion is in the url, replace it
                 # with the replacement expansion and try again
                 # If that fails, raise the error
@@ -446,6 +486,7 @@ class OnyxConfluence:
                         _PROBLEMATIC_EXPANSIONS,
                         _REPLACEMENT_EXPANSIONS,
                     )
+                    replaced_problematic_expansions = raw_response.status_code == 500
                     continue
                 if (
                     raw_response.status_code == 500
@@ -459,8 +500,8 @@ class OnyxConfluence:
                         f"Error: {e} \n"
                         f"Reducing limit from {limit} to {new_limit} and trying again."
                     )
-                    url_suffix = url_suffix.replace(
-                        f"limit={limit}", f"limit={new_limit}"
+                    url_suffix = update_param_in_path(
+                        url_suffix, "limit", str(new_limit)
                     )
                     limit = new_limit
                     continue
@@ -473,20 +514,30 @@ class OnyxConfluence:
                 )
                 raise e
 
+            if replaced_problematic_expansions and self._is_cloud:
+                # the replacement alone fixed the bug's 500, so skip the failing
+                # call for later queries too
+                self._use_replacement_expansions = True
+
             try:
-                next_response = raw_response.json()
-            except Exception as e:
-                logger.exception(
-                    f"Failed to parse response as JSON. Response: {raw_response.__dict__}"
-                )
-                raise e
+                next_response = orjson.loads(raw_response.content)
+            except orjson.JSONDecodeError:
+                # orjson is stricter than the stdlib parser (e.g. about invalid
+                # utf-8), so give the lenient parser a chance before failing
+                try:
+                    next_response = raw_response.json()
+                except Exception as e:
+                    logger.exception(
+                        f"Failed to parse response as JSON. Response: {raw_response.__dict__}"
+                    )
+                    raise e
 
-            # yield the results individually
             results = cast(list[dict[str, Any]], next_response.get("results", []))
-            yield from results
+            yield results
 
             old_url_suffix = url_suffix
             url_suffix = cast(str, next_response.get("_links", {}).get("next", ""))
+            previous_start = get_start_param_from_url(old_url_suffix)
 
             # make sure we don't update the start by more than the amount
             # of results we were able to retrieve. The Confluence API has a
@@ -496,14 +547,17 @@ class OnyxConfluence:
             # This will cause us to miss results.
             if url_suffix and "start" in url_suffix:
                 new_start = get_start_param_from_url(url_suffix)
-                previous_start = get_start_param_from_url(old_url_suffix)
                 if new_start - previous_start > len(results):
                     logger.debug(
-                        f"Start was updated by more than the amount of results "
-                        f"retrieved for `{url_suffix}`. This is a bug with Confluence, "
+                        "Start was updated by more than the amount of results "
+                        "retrieved for `%s`. This is a bug with Confluence, "
                         "but we have logic to work around it - don't worry this isn't"
-                        f" causing an issue. Start: {new_start}, Previous Start: "
-                        f"{previous_start}, Len Results: {len(results)}."
+                        " causing an issue. Start: %s, Previous Start: "
+                        "%s, Len Results: %s.",
+                        url_suffix,
+                        new_start,
+                        previous_start,
+                        len(results),
                     )
 
                     # Update the url_suffix to use the adjusted start
@@ -514,7 +568,6 @@ class OnyxConfluence:
 
             # some APIs don't properly paginate, so we need to manually update the `start` param
             if auto_paginate and len(results) > 0:
-                previous_start = get_start_param_from_url(old_url_suffix)
                 updated_start = previous_start + len(results)
                 url_suffix = update_param_in_path(
                     old_url_suffix, "start", str(updated_start)
@@ -547,20 +600,49 @@ class OnyxConfluence:
         All expansion paginations use default pagination limit (defined by Atlassian).
         """
 
-        def _traverse_and_update(data: dict | list) -> None:
-            if isinstance(data, dict):
-                next_url = data.get("_links", {}).get("next")
-                if next_url and "results" in data:
-                    data["results"].extend(self._paginate_url(next_url))
-
-                for value in data.values():
-                    _traverse_and_update(value)
-            elif isinstance(data, list):
-                for item in data:
-                    _traverse_and_update(item)
+        def _paginate_expansion(next_url: str) -> list[dict[str, Any]]:
+            all_results: list[dict[str, Any]] = []
+            for results in self._paginate_url_batched(next_url):
+                all_results.extend(results)
+            return all_results
 
         for confluence_object in self.paginated_cql_retrieval(cql, expand, limit):
-            _traverse_and_update(confluence_object)
+            unvisited: list[Any] = [confluence_object]
+            while unvisited:
+                # walk the object with an explicit stack since expansions can be
+                # nested deeply enough to hit the recursion limit
+                expansions: list[tuple[list[dict[str, Any]], str]] = []
+                stack: deque[Any] = deque(unvisited)
+                while stack:
+                    node = stack.pop()
+                    if isinstance(node, dict):
+                        next_url = node.get("_links", {}).get("next")
+                        if next_url and "results" in node:
+                            expansions.append((node["results"], next_url))
+
+                        stack.extend(node.values())
+                    elif isinstance(node, list):
+                        stack.extend(node)
+
+                # the expansions are independent of each other, so fetch them
+                # in parallel. Rate limiting is still handled per call by self.get
+                if len(expansions) == 1:
+                    expansion_results = [_paginate_expansion(expansions[0][1])]
+                else:
+                    expansion_results = run_functions_tuples_in_parallel(
+                        [
+                            (_paginate_expansion, (next_url,))
+                            for _, next_url in expansions
+                        ],
+                        max_workers=_MAX_EXPANSION_PAGINATION_WORKERS,
+                    )
+
+                # the newly fetched results may have expansions of their own
+                unvisited = []
+                for (results, _), new_results in zip(expansions, expansion_results):
+                    results.extend(new_results)
+                    unvisited.extend(new_results)
+
             yield confluence_object
 
     def paginated_cql_user_retrieval(
@@ -665,9 +747,8 @@ class OnyxConfluence:
         It's a confluence specific endpoint that can be used to fetch groups.
         """
         user_field = "accountId" if self.cloud else "key"
-        user_value = user_id
         # Server uses userKey (but calls it key during the API call), Cloud uses accountId
-        user_query = f"{user_field}={quote(user_value)}"
+        user_query = urlencode({user_field: user_id}, quote_via=quote)
 
         url = f"rest/api/user/memberof?{user_query}"
         yield from self._paginate_url(url, limit)
@@ -693,7 +774,7 @@ class OnyxConfluence:
         THIS DOESN'T WORK FOR SERVER because it breaks when there is a slash in the group name.
         E.g. neither "test/group" nor "test%2Fgroup" works for confluence.
         """
-        group_name = quote(group_name)
+        group_name = quote(group_name, safe="")
         yield from self._paginate_url(f"rest/api/group/{group_name}/member", limit)
 
     def get_all_space_permissions_server(
@@ -1,10 +1,14 @@
 import io
-import math
+import random
+import threading
 import time
 from collections.abc import Callable
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from functools import wraps
 from io import BytesIO
 from pathlib import Path
 from typing import Any
@@ -42,6 +46,23 @@ logger = setup_logger()
 
 CONFLUENCE_OAUTH_TOKEN_URL = "https://auth.atlassian.com/oauth/token"
 RATE_LIMIT_MESSAGE_LOWERCASE = "Rate limit exceeded".lower()
+# non-429 statuses that may carry the rate limit message in their body
+_RATE_LIMIT_MESSAGE_STATUS_CODES = (400, 403)
+RATE_LIMIT_MIN_DELAY = 2
+RATE_LIMIT_MAX_DELAY = 60
+RATE_LIMIT_MAX_RETRIES = 5
+RATE_LIMIT_TIMEOUT = 600
+
+
+class RateLimitWindow:
+    """Deadline (time.monotonic) before which a Confluence client shouldn't make
+    another call, set when a response tells us we've used up the current rate
+    limit window. Atlassian rate limits per tenant and credential, so each
+    client keeps its own, shared by the threads that use that client."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.next_allowed_at: float | None = None
 
 
 class TokenResponse(BaseModel):
@@ -403,49 +424,65 @@ F = TypeVar("F", bound=Callable[..., Any])
 # https://developer.atlassian.com/cloud/confluence/rate-limiting/
 # this uses the native rate limiting option provided by the
 # confluence client and otherwise applies a simpler set of error handling
-def handle_confluence_rate_limit(confluence_call: F) -> F:
-    def wrapped_call(*args: list[Any], **kwargs: Any) -> Any:
-        MAX_RETRIES = 5
-
-        TIMEOUT = 600
-        timeout_at = time.monotonic() + TIMEOUT
+def _call_with_rate_limit_retries(
+    confluence_call: Callable[[], Any], rate_limit_window: RateLimitWindow
+) -> Any:
+    """Makes a Confluence call, retrying when we're rate limited and when the
+    client raises its intermittent AttributeError."""
+    timeout_at = time.monotonic() + RATE_LIMIT_TIMEOUT
+
+    for attempt in range(RATE_LIMIT_MAX_RETRIES):
+        if time.monotonic() > timeout_at:
+            raise TimeoutError(
+                f"Confluence call attempts took longer than {RATE_LIMIT_TIMEOUT} seconds."
+            )
 
-        for attempt in range(MAX_RETRIES):
-            if time.monotonic() > timeout_at:
+        try:
+            # we're relying more on the client to rate limit itself
+            # and applying our own retries in a more specific set of circumstances.
+            # wait out an exhausted rate limit window before the call takes
+            # any credential lock, so we don't sleep while holding it
+            _wait_for_rate_limit_reset(rate_limit_window)
+            result = confluence_call()
+            _record_rate_limit_headers(result, rate_limit_window)
+            return result
+        except requests.HTTPError as e:
+            delay = _handle_http_error(e, attempt)
+            if time.monotonic() + delay > timeout_at:
                 raise TimeoutError(
-                    f"Confluence call attempts took longer than {TIMEOUT} seconds."
+                    f"Confluence call attempts would take longer than {RATE_LIMIT_TIMEOUT} seconds."
                 )
 
-            try:
-                # we're relying more on the client to rate limit itself
-                # and applying our own retries in a more specific set of circumstances
-                return confluence_call(*args, **kwargs)
-            except requests.HTTPError as e:
-                delay_until = _handle_http_error(e, attempt)
-                logger.warning(
-                    f"HTTPError in confluence call. "
-                    f"Retrying in {delay_until} seconds..."
-                )
-                while time.monotonic() < delay_until:
-                    # in the future, check a signal here to exit
-                    time.sleep(1)
-            except AttributeError as e:
-                # Some error within the Confluence library, unclear why it fails.
-                # Users reported it to be intermittent, so just retry
-                if attempt == MAX_RETRIES - 1:
-                    raise e
-
-                logger.exception(
-                    "Confluence Client raised an AttributeError. Retrying..."
-                )
-                time.sleep(5)
+            logger.warning(
+                f"HTTPError in confluence call. Retrying in {delay:.1f} seconds..."
+            )
+            time.sleep(delay)
+        except AttributeError as e:
+            # Some error within the Confluence library, unclear why it fails.
+            # Users reported it to be intermittent, so just retry
+            if attempt == RATE_LIMIT_MAX_RETRIES - 1:
+                raise e
+
+            logger.exception("Confluence Client raised an AttributeError. Retrying...")
+            time.sleep(5)
+
+
+def handle_confluence_rate_limit(confluence_call: F) -> F:
+    rate_limit_window = RateLimitWindow()
+
+    @wraps(confluence_call)
+    def wrapped_call(*args: list[Any], **kwargs: Any) -> Any:
+        return _call_with_rate_limit_retries(
+            lambda: confluence_call(*args, **kwargs), rate_limit_window
+        )
 
     return cast(F, wrapped_call)
 
 
-def _handle_http_error(e: requests.HTTPError, attempt: int) -> int:
-    MIN_DELAY = 2
-    MAX_DELAY = 60
+def _handle_http_error(e: requests.HTTPError, attempt: int) -> float:
+    """Returns the number of seconds to wait before retrying a rate limited call"""
+    MIN_DELAY = RATE_LIMIT_MIN_DELAY
+    MAX_DELAY = RATE_LIMIT_MAX_DELAY
     STARTING_DELAY = 5
     BACKOFF = 2
 
@@ -454,9 +491,12 @@ def _handle_http_error(e: requests.HTTPError, attempt: int) -> int:
         logger.warning("HTTPError with `None` as response or as headers")
         raise e
 
-    if (
-        e.response.status_code != 429
-        and RATE_LIMIT_MESSAGE_LOWERCASE not in e.response.text.lower()
+    # only read the body for statuses Confluence is known to rate limit with,
+    # error pages for other failures can be large
+    status_code = e.response.status_code
+    if status_code != 429 and (
+        status_code not in _RATE_LIMIT_MESSAGE_STATUS_CODES
+        or RATE_LIMIT_MESSAGE_LOWERCASE not in e.response.text.lower()
     ):
         raise e
 
@@ -464,8 +504,8 @@ def _handle_http_error(e: requests.HTTPError, attempt: int) -> int:
 
     retry_after_header = e.response.headers.get("Retry-After")
     if retry_after_header is not None:
-        try:
-            retry_after = int(retry_after_header)
+        retry_after = _parse_retry_after(retry_after_header)
+        if retry_after is not None:
             if retry_after > MAX_DELAY:
                 logger.warning(
                     f"Clamping retry_after from {retry_after} to {MAX_DELAY} seconds..."
@@ -473,22 +513,110 @@ def _handle_http_error(e: requests.HTTPError, attempt: int) -> int:
                 retry_after = MAX_DELAY
             if retry_after < MIN_DELAY:
                 retry_after = MIN_DELAY
-        except ValueError:
-            pass
 
     if retry_after is not None:
         logger.warning(
             f"Rate limiting with retry header. Retrying after {retry_after} seconds..."
         )
-        delay = retry_after
+        delay: float = retry_after
     else:
         logger.warning(
             "Rate limiting without retry header. Retrying with exponential backoff..."
         )
-        delay = min(STARTING_DELAY * (BACKOFF**attempt), MAX_DELAY)
+        # jitter the backoff so that workers rate limited at the same time
+        # don't all retry in lockstep
+        max_backoff = min(STARTING_DELAY * (BACKOFF**attempt), MAX_DELAY)
+        delay = random.uniform(MIN_DELAY, max_backoff)
+
+    return delay
+
+
+def _parse_retry_after(retry_after_header: str) -> int | None:
+    """Retry-After is either a number of seconds or an HTTP-date (RFC 7231)"""
+    try:
+        return int(retry_after_header)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after_header)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return int((retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _parse_rate_limit_reset(reset_header: str) -> float | None:
+    """Returns the number of seconds until the rate limit window resets.
+    Atlassian sends an ISO 8601 timestamp, some deployments send epoch seconds."""
+    try:
+        reset_at = datetime.fromtimestamp(float(reset_header), tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        try:
+            reset_at = datetime.fromisoformat(reset_header)
+        except ValueError:
+            return None
+
+    if reset_at.tzinfo is None:
+        reset_at = reset_at.replace(tzinfo=timezone.utc)
+
+    return (reset_at - datetime.now(timezone.utc)).total_seconds()
+
+
+def _record_rate_limit_headers(
+    response: Any, rate_limit_window: RateLimitWindow
+) -> None:
+    """If a raw response says there are no requests left in the current rate
+    limit window, hold off the next Confluence calls until the window
+    resets instead of sending a request we know will get a 429."""
+    if not isinstance(response, requests.Response):
+        return
+
+    remaining_header = response.headers.get("X-RateLimit-Remaining")
+    if remaining_header is None:
+        return
+
+    try:
+        if int(remaining_header) > 0:
+            return
+    except ValueError:
+        return
+
+    delay: float | None = None
+    reset_header = response.headers.get("X-RateLimit-Reset")
+    if reset_header:
+        delay = _parse_rate_limit_reset(reset_header)
+
+    if delay is None:
+        delay = RATE_LIMIT_MIN_DELAY
+    delay = min(max(delay, RATE_LIMIT_MIN_DELAY), RATE_LIMIT_MAX_DELAY)
+
+    logger.warning(
+        f"Confluence rate limit window exhausted. "
+        f"Delaying the next call by {delay:.1f} seconds..."
+    )
+    with rate_limit_window.lock:
+        next_allowed_at = time.monotonic() + delay
+        if (
+            rate_limit_window.next_allowed_at is None
+            or next_allowed_at > rate_limit_window.next_allowed_at
+        ):
+            rate_limit_window.next_allowed_at = next_allowed_at
+
+
+def _wait_for_rate_limit_reset(rate_limit_window: RateLimitWindow) -> None:
+    with rate_limit_window.lock:
+        next_allowed_at = rate_limit_window.next_allowed_at
+
+    if next_allowed_at is None:
+        return
 
-    delay_until = math.ceil(time.monotonic() + delay)
-    return delay_until
+    remaining = next_allowed_at - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
 
 
 def get_single_param_from_url(url: str, param: str) -> str | None:
@@ -497,6 +625,7 @@ def get_single_param_from_url(url: str, param: str) -> str | None:
     return parse_qs(parsed_url.query).get(param, [None])[0]
 
 
+@lru_cache(maxsize=1024)
 def get_start_param_from_url(url: str) -> int:
     """Get the start parameter from a url"""
     start_str = get_single_param_from_url(url, "start")
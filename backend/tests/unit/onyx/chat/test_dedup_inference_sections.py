@@ -0,0 +1,114 @@
+from onyx.agents.agent_search.shared_graph_utils.operators import (
+    dedup_inference_sections,
+)
+from onyx.agents.agent_search.shared_graph_utils.operators import (
+    dedup_inference_sections_by_chunk,
+)
+from onyx.context.search.models import InferenceChunk
+from onyx.context.search.models import InferenceSection
+from tests.unit.onyx.chat.test_prune_and_merge import create_inference_chunk
+
+
+def _make_section(
+    center_chunk: InferenceChunk, chunks: list[InferenceChunk]
+) -> InferenceSection:
+    return InferenceSection(
+        center_chunk=center_chunk,
+        chunks=chunks,
+        combined_content="\n".join(chunk.content for chunk in chunks),
+    )
+
+
+CHUNK_X = create_inference_chunk("doc1", 1, "Content X", 10.0)
+CHUNK_Y = create_inference_chunk("doc1", 2, "Content Y", 5.0)
+CHUNK_Z = create_inference_chunk("doc1", 3, "Content Z", 4.0)
+
+
+def test_dedup_by_chunk_keeps_sections_with_different_chunks() -> None:
+    section_xy = _make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])
+    section_xz = _make_section(CHUNK_X, [CHUNK_X, CHUNK_Z])
+
+    deduped = dedup_inference_sections_by_chunk([section_xy, section_xz])
+    assert deduped == [section_xy, section_xz]
+
+    # the state reducer still gets to merge the union of the chunks
+    merged = dedup_inference_sections([], deduped)
+    assert len(merged) == 1
+    assert [chunk.chunk_id for chunk in merged[0].chunks] == [1, 2, 3]
+
+
+def test_dedup_by_chunk_drops_exact_duplicates() -> None:
+    section = _make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])
+    duplicate = _make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])
+    rescored = _make_section(
+        CHUNK_X, [CHUNK_X, create_inference_chunk("doc1", 2, "Content Y", 7.0)]
+    )
+
+    deduped = dedup_inference_sections_by_chunk(iter([section, duplicate, rescored]))
+
+    assert deduped == [section, rescored]
+
+
+def test_merged_sections_are_stable_under_remerge() -> None:
+    # the reducer short-circuit relies on this
+    merged = dedup_inference_sections([], [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])])
+
+    assert dedup_inference_sections(merged, []) == merged
+
+
+def test_reducer_returns_state_when_update_adds_nothing() -> None:
+    state = dedup_inference_sections(
+        [], [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Y, CHUNK_Z])]
+    )
+
+    update = [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])]
+    lower_scored = create_inference_chunk("doc1", 2, "Content Y", 1.0)
+    update.append(_make_section(CHUNK_X, [CHUNK_X, lower_scored]))
+
+    assert dedup_inference_sections(state, update) is state
+
+
+def test_reducer_remerges_on_higher_score() -> None:
+    state = dedup_inference_sections([], [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])])
+    higher_scored = create_inference_chunk("doc1", 2, "Content Y", 50.0)
+
+    merged = dedup_inference_sections(
+        state, [_make_section(higher_scored, [CHUNK_X, higher_scored])]
+    )
+
+    assert merged is not state
+    assert merged[0].center_chunk.chunk_id == 2
+    assert merged[0].center_chunk.score == 50.0
+
+
+def test_reducer_remerges_on_new_chunk() -> None:
+    state = dedup_inference_sections([], [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Y])])
+
+    merged = dedup_inference_sections(
+        state, [_make_section(CHUNK_X, [CHUNK_X, CHUNK_Z])]
+    )
+
+    assert merged is not state
+    assert [chunk.chunk_id for chunk in merged[0].chunks] == [1, 2, 3]
+
+
+def test_reducer_none_scores() -> None:
+    unscored = create_inference_chunk("doc2", 1, "Doc 2 Content", None)
+    state = dedup_inference_sections([], [_make_section(unscored, [unscored])])
+
+    # None vs None is a tie, nothing to merge
+    assert (
+        dedup_inference_sections(state, [_make_section(unscored, [unscored])]) is state
+    )
+
+    # a score where there was none is an improvement
+    scored = create_inference_chunk("doc2", 1, "Doc 2 Content", 3.0)
+    merged = dedup_inference_sections(state, [_make_section(scored, [scored])])
+    assert merged is not state
+    assert merged[0].center_chunk.score == 3.0
+
+    # no score where there already is one is not
+    assert (
+        dedup_inference_sections(merged, [_make_section(unscored, [unscored])])
+        is merged
+    )
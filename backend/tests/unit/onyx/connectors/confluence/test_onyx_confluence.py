@@ -0,0 +1,425 @@
+import gc
+import json
+import re
+import sys
+import threading
+import time
+import weakref
+from collections.abc import Callable
+from collections.abc import Iterator
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Any
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pytest
+from atlassian import Confluence  # type: ignore
+from requests import HTTPError
+from requests import Response
+
+from onyx.connectors.confluence.onyx_confluence import OnyxConfluence
+from onyx.connectors.credentials_provider import OnyxStaticCredentialsProvider
+from onyx.utils.threadpool_concurrency import run_functions_tuples_in_parallel
+
+
+def _make_response(status_code: int, content: bytes = b'{"results": []}') -> Response:
+    response = Response()
+    response.status_code = status_code
+    response._content = content
+    return response
+
+
+def _make_rate_limit_error(
+    status_code: int = 429,
+    text: str = "Rate limit exceeded",
+    retry_after: str | None = None,
+) -> HTTPError:
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return HTTPError(response=Mock(status_code=status_code, text=text, headers=headers))
+
+
+@pytest.fixture
+def mock_sleep() -> Iterator[Mock]:
+    with patch("onyx.connectors.confluence.utils.time.sleep") as mock:
+        yield mock
+
+
+def _make_confluence_client() -> OnyxConfluence:
+    credentials_provider = OnyxStaticCredentialsProvider(
+        None, "confluence", {"confluence_access_token": "token"}
+    )
+    confluence = OnyxConfluence(
+        is_cloud=True,
+        url="https://example.atlassian.net/wiki",
+        credentials_provider=credentials_provider,
+    )
+    confluence._confluence = Mock()
+    return confluence
+
+
+def _make_exhausted_window_response() -> Response:
+    response = _make_response(200)
+    response.headers["X-RateLimit-Remaining"] = "0"
+    response.headers["X-RateLimit-Reset"] = str(time.time() + 10)
+    return response
+
+
+@pytest.fixture
+def confluence_client() -> OnyxConfluence:
+    return _make_confluence_client()
+
+
+def _requested_paths(confluence: OnyxConfluence) -> list[str]:
+    return [call.kwargs["path"] for call in confluence._confluence.get.call_args_list]
+
+
+def test_replacement_expansions_remembered_after_server_error(
+    confluence_client: OnyxConfluence,
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_response(500),
+        _make_response(200),
+        _make_response(200),
+    ]
+
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+
+    paths = _requested_paths(confluence_client)
+    assert "body.storage.value" in paths[0]
+    assert "body.view.value" in paths[1]
+    # the second query skips the call that is known to fail
+    assert "body.view.value" in paths[2]
+    assert len(paths) == 3
+
+
+def test_replacement_expansions_not_remembered_when_limit_was_the_problem(
+    confluence_client: OnyxConfluence,
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_response(500),
+        # the replacement fails too, only halving the limit helps
+        _make_response(500),
+        _make_response(200),
+        _make_response(200),
+    ]
+
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+
+    paths = _requested_paths(confluence_client)
+    assert "body.view.value" in paths[1] and "limit=1000" in paths[1]
+    assert "body.view.value" in paths[2] and "limit=500" in paths[2]
+    assert "body.storage.value" in paths[3]
+    assert not confluence_client._use_replacement_expansions
+
+
+@pytest.mark.parametrize("status_code", [429, 502, 503])
+def test_replacement_expansions_not_remembered_after_transient_error(
+    confluence_client: OnyxConfluence, status_code: int
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_response(status_code),
+        _make_response(200),
+        _make_response(200),
+    ]
+
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+    list(confluence_client._paginate_url("rest/api/content?expand=body.storage.value"))
+
+    paths = _requested_paths(confluence_client)
+    assert "body.view.value" in paths[1]
+    assert "body.storage.value" in paths[2]
+
+
+def test_wrapped_methods_keep_client_metadata(
+    confluence_client: OnyxConfluence,
+) -> None:
+    confluence_client._confluence = Confluence("https://example.atlassian.net/wiki")
+
+    assert confluence_client.get_page_by_id.__name__ == "get_page_by_id"
+    assert confluence_client.get_page_by_id.__doc__ == Confluence.get_page_by_id.__doc__
+
+
+def test_wrapped_methods_do_not_keep_replaced_clients_alive(
+    confluence_client: OnyxConfluence,
+) -> None:
+    client = Confluence("https://example.atlassian.net/wiki")
+    confluence_client._confluence = client
+    wrapped_method = confluence_client.get_page_by_id
+    assert wrapped_method.__wrapped__ is Confluence.get_page_by_id
+
+    # e.g. the client being re-initialized after a credential renewal
+    client_ref = weakref.ref(client)
+    confluence_client._confluence = Confluence("https://example.atlassian.net/wiki")
+    del client
+    gc.collect()
+
+    assert client_ref() is None
+
+
+def test_get_sleeps_once_per_retry(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_rate_limit_error(retry_after="5"),
+        _make_rate_limit_error(retry_after="5"),
+        "success",
+    ]
+
+    assert confluence_client.get("rest/api/content") == "success"
+
+    assert confluence_client._confluence.get.call_count == 3
+    assert [call.args[0] for call in mock_sleep.call_args_list] == [5, 5]
+
+
+def test_get_times_out_instead_of_sleeping_past_the_deadline(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.side_effect = _make_rate_limit_error(
+        retry_after="60"
+    )
+
+    with patch("onyx.connectors.confluence.utils.RATE_LIMIT_TIMEOUT", 30):
+        with pytest.raises(TimeoutError):
+            confluence_client.get("rest/api/content")
+
+    mock_sleep.assert_not_called()
+
+
+def test_get_backoff_without_retry_header_is_jittered(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_rate_limit_error() for _ in range(4)
+    ] + ["success"]
+
+    assert confluence_client.get("rest/api/content") == "success"
+
+    delays = [call.args[0] for call in mock_sleep.call_args_list]
+    assert len(delays) == 4
+    for attempt, delay in enumerate(delays):
+        assert 2 <= delay <= min(5 * 2**attempt, 60)
+
+
+def test_get_delays_next_call_when_rate_limit_window_is_exhausted(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    response = _make_exhausted_window_response()
+    confluence_client._confluence.get.return_value = response
+
+    assert confluence_client.get("rest/api/content") is response
+    mock_sleep.assert_not_called()
+
+    confluence_client.get("rest/api/content")
+
+    assert mock_sleep.call_count == 1
+    assert 8 < mock_sleep.call_args.args[0] <= 10
+
+
+def test_exhausted_rate_limit_window_is_shared_across_threads(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.return_value = _make_exhausted_window_response()
+
+    confluence_client.get("rest/api/content")
+
+    # e.g. an expansion worker using the same client
+    worker = threading.Thread(target=confluence_client.get, args=("rest/api/content",))
+    worker.start()
+    worker.join()
+
+    assert mock_sleep.call_count == 1
+    assert 8 < mock_sleep.call_args.args[0] <= 10
+
+
+def test_exhausted_rate_limit_window_does_not_delay_other_clients(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.return_value = _make_exhausted_window_response()
+    confluence_client.get("rest/api/content")
+
+    other_client = _make_confluence_client()
+    other_client._confluence.get.return_value = "success"
+
+    assert other_client.get("rest/api/content") == "success"
+    mock_sleep.assert_not_called()
+
+
+def test_get_retries_rate_limit_message_on_forbidden(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.side_effect = [
+        _make_rate_limit_error(status_code=403),
+        "success",
+    ]
+
+    assert confluence_client.get("rest/api/content") == "success"
+    assert mock_sleep.call_count == 1
+
+
+def test_get_does_not_retry_rate_limit_message_on_server_error(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    confluence_client._confluence.get.side_effect = _make_rate_limit_error(
+        status_code=500
+    )
+
+    with pytest.raises(HTTPError):
+        confluence_client.get("rest/api/content")
+
+    assert confluence_client._confluence.get.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_get_honors_retry_after_http_date(
+    confluence_client: OnyxConfluence, mock_sleep: Mock
+) -> None:
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    confluence_client._confluence.get.side_effect = [
+        _make_rate_limit_error(retry_after=format_datetime(retry_at, usegmt=True)),
+        "success",
+    ]
+
+    assert confluence_client.get("rest/api/content") == "success"
+    assert 28 <= mock_sleep.call_args.args[0] <= 30
+
+
+def _paginated(
+    results: list[dict[str, Any]], next_url: str | None = None
+) -> dict[str, Any]:
+    return {"results": results, "_links": {"next": next_url} if next_url else {}}
+
+
+def _serve_pages(
+    confluence: OnyxConfluence, get_page: Callable[[str], dict[str, Any]]
+) -> None:
+    """Serves each request from get_page, keyed by the path without the
+    limit param that pagination adds."""
+
+    def get(path: str, **kwargs: Any) -> Response:
+        page = get_page(re.sub(r"[?&]limit=\d+$", "", path))
+        return _make_response(200, json.dumps(page).encode())
+
+    confluence._confluence.get.side_effect = get
+
+
+_SEARCH_PATH = "rest/api/content/search?cql=type=page"
+_COMMENTS_PATH = "rest/api/content/1/child/comment?start=1"
+_ATTACHMENTS_PATH = "rest/api/content/1/child/attachment?start=1"
+
+
+def _make_page_with_expansions() -> dict[str, Any]:
+    return {
+        "id": "1",
+        "children": {
+            "comment": _paginated([{"id": "c1"}], _COMMENTS_PATH),
+            "attachment": _paginated([{"id": "a1"}], _ATTACHMENTS_PATH),
+        },
+    }
+
+
+def test_sibling_expansions_fetched_in_one_round(
+    confluence_client: OnyxConfluence,
+) -> None:
+    pages = {
+        _SEARCH_PATH: _paginated([_make_page_with_expansions()]),
+        _COMMENTS_PATH: _paginated([{"id": "c2"}]),
+        _ATTACHMENTS_PATH: _paginated([{"id": "a2"}]),
+    }
+    _serve_pages(confluence_client, pages.__getitem__)
+
+    with patch(
+        "onyx.connectors.confluence.onyx_confluence.run_functions_tuples_in_parallel",
+        wraps=run_functions_tuples_in_parallel,
+    ) as mock_parallel:
+        (page,) = confluence_client.cql_paginate_all_expansions("type=page")
+
+    # both expansions of the page went to the thread pool together
+    assert len(mock_parallel.call_args_list[0].args[0]) == 2
+
+    # each expansion's results go to the container they were fetched for
+    children = page["children"]
+    assert [c["id"] for c in children["comment"]["results"]] == ["c1", "c2"]
+    assert [a["id"] for a in children["attachment"]["results"]] == ["a1", "a2"]
+
+
+def test_nested_expansions_in_fetched_results_are_fetched(
+    confluence_client: OnyxConfluence,
+) -> None:
+    replies_path = "rest/api/content/c2/child/comment?start=1"
+    pages = {
+        _SEARCH_PATH: _paginated([_make_page_with_expansions()]),
+        _COMMENTS_PATH: _paginated(
+            [
+                {
+                    "id": "c2",
+                    "children": {"comment": _paginated([{"id": "r1"}], replies_path)},
+                }
+            ]
+        ),
+        _ATTACHMENTS_PATH: _paginated([{"id": "a2"}]),
+        replies_path: _paginated([{"id": "r2"}]),
+    }
+    _serve_pages(confluence_client, pages.__getitem__)
+
+    (page,) = confluence_client.cql_paginate_all_expansions("type=page")
+
+    comments = page["children"]["comment"]["results"]
+    assert [c["id"] for c in comments] == ["c1", "c2"]
+    replies = comments[1]["children"]["comment"]["results"]
+    assert [r["id"] for r in replies] == ["r1", "r2"]
+    assert [a["id"] for a in page["children"]["attachment"]["results"]] == [
+        "a1",
+        "a2",
+    ]
+
+
+def test_expansion_worker_error_is_raised(confluence_client: OnyxConfluence) -> None:
+    def get_page(path: str) -> dict[str, Any]:
+        if path == _ATTACHMENTS_PATH:
+            raise RuntimeError("attachment fetch failed")
+        return {
+            _SEARCH_PATH: _paginated([_make_page_with_expansions()]),
+            _COMMENTS_PATH: _paginated([{"id": "c2"}]),
+        }[path]
+
+    _serve_pages(confluence_client, get_page)
+
+    with pytest.raises(RuntimeError, match="attachment fetch failed"):
+        list(confluence_client.cql_paginate_all_expansions("type=page"))
+
+
+def test_expansions_nested_past_the_recursion_limit(
+    confluence_client: OnyxConfluence,
+) -> None:
+    depth = sys.getrecursionlimit() + 100
+
+    def _reply_path(reply_id: int) -> str:
+        return f"rest/api/content/{reply_id}/child/comment?start=1"
+
+    def _make_reply(reply_id: int) -> dict[str, Any]:
+        reply: dict[str, Any] = {"id": str(reply_id)}
+        if reply_id < depth:
+            reply["children"] = {"comment": _paginated([], _reply_path(reply_id))}
+        return reply
+
+    def get_page(path: str) -> dict[str, Any]:
+        if path == _SEARCH_PATH:
+            return _paginated([_make_reply(0)])
+        reply_id = int(path.split("/")[3])
+        return _paginated([_make_reply(reply_id + 1)])
+
+    _serve_pages(confluence_client, get_page)
+
+    (page,) = confluence_client.cql_paginate_all_expansions("type=page")
+
+    # each reply chain level was fetched and attached under its parent
+    node = page
+    for reply_id in range(1, depth + 1):
+        (node,) = node["children"]["comment"]["results"]
+        assert node["id"] == str(reply_id)
+    assert "children" not in node
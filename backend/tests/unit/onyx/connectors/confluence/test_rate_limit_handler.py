@@ -3,6 +3,7 @@ from unittest.mock import Mock
 import pytest
 from requests import HTTPError
 
+from onyx.connectors.confluence.utils import _parse_rate_limit_reset
 from onyx.connectors.confluence.utils import handle_confluence_rate_limit
 
 
@@ -61,3 +62,8 @@ def test_non_rate_limit_error(mock_confluence_call: Mock) -> None:
         handled_call()
 
     assert mock_confluence_call.call_count == 1
+
+
+@pytest.mark.parametrize("reset_header", ["inf", "1e300", "not a timestamp"])
+def test_unparseable_rate_limit_reset(reset_header: str) -> None:
+    assert _parse_rate_limit_reset(reset_header) is None